@@ -0,0 +1,160 @@
+"""Замер пропускной способности webhook-кластера в зависимости от числа воркеров.
+
+Запуск: python bench_cluster.py --workers 1 2 4 --chats 32
+
+Воркеры выполняют настоящие обработчики бота (bot:process_update) на временной
+копии базы в режиме WAL и с пустым дисковым кэшем карт на каждый прогон.
+Отправка сообщений в Telegram заменена записью ответа в файл, чтобы посчитать
+готовые карты и ошибки. Ускорение видно только на машине с несколькими ядрами.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from cluster import ShardRouter
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'bench-secret'
+
+
+def bench_setup():
+    """Подготовка воркера: бот на копии базы, ответы пишутся в файл вместо Telegram"""
+    import bot as maps_bot
+
+    maps_bot.setup(threaded=False, database=os.environ['BENCH_DATABASE'])
+    replies_path = os.environ['BENCH_REPLIES']
+
+    def record(kind):
+        def send(chat_id, content=None, *args, **kwargs):
+            text = content if isinstance(content, str) else kwargs.get('caption') or ''
+            line = json.dumps({'kind': kind, 'text': text.strip().split('\n')[0]},
+                              ensure_ascii=False)
+            # Короткая запись с O_APPEND не перемешивается между процессами
+            with open(replies_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        return send
+
+    for kind in ('send_message', 'send_photo', 'send_document', 'send_animation'):
+        setattr(maps_bot.bot, kind, record(kind))
+
+
+def pick_cities(database, count):
+    conn = sqlite3.connect(database)
+    with conn:
+        rows = conn.execute('SELECT city FROM cities ORDER BY population DESC LIMIT ?',
+                            (count,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def make_update(update_id, chat_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Bench'},
+            'text': text,
+        },
+    }
+
+
+def make_updates(cities, chats, per_chat):
+    """У каждого чата свой набор городов, поэтому карты не берутся из кэша друг друга"""
+    updates = []
+    for chat in range(chats):
+        chat_id = 1000 + chat
+        for i in range(per_chat):
+            city = cities[(chat * per_chat + i) % len(cities)]
+            updates.append(make_update(len(updates) + 1, chat_id, f'/remember_city {city}'))
+        updates.append(make_update(len(updates) + 1, chat_id, '/map_detailed'))
+        updates.append(make_update(len(updates) + 1, chat_id, '/map_heatmap'))
+    return updates
+
+
+def post_updates(port, updates, clients):
+    local = threading.local()
+
+    def post(update):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection('127.0.0.1', port)
+        body = json.dumps(update, ensure_ascii=False).encode('utf-8')
+        local.conn.request('POST', '/', body, {'Content-Type': 'application/json',
+                                               SECRET_HEADER: SECRET})
+        response = local.conn.getresponse()
+        response.read()
+        return response.status
+
+    with ThreadPoolExecutor(clients) as pool:
+        statuses = list(pool.map(post, updates))
+    assert all(status == 200 for status in statuses), statuses
+
+
+def count_replies(path):
+    maps = errors = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            reply = json.loads(line)
+            if reply['kind'] == 'send_photo':
+                maps += 1
+            elif reply['text'].startswith('❌'):
+                errors += 1
+    return maps, errors
+
+
+def run(workers, database, updates, clients):
+    with tempfile.TemporaryDirectory() as directory:
+        # Каждый прогон - с чистой копией базы и пустым кэшем карт
+        os.environ['BENCH_DATABASE'] = os.path.join(directory, 'database.db')
+        os.environ['BENCH_REPLIES'] = os.path.join(directory, 'replies.jsonl')
+        os.environ['RENDER_CACHE_DIR'] = os.path.join(directory, 'render_cache')
+        shutil.copy(database, os.environ['BENCH_DATABASE'])
+        open(os.environ['BENCH_REPLIES'], 'w').close()
+
+        router = ShardRouter(workers, 'bot:process_update', 'bench_cluster:bench_setup',
+                             maxsize=len(updates))
+        server = WebhookServer(('127.0.0.1', 0), router.dispatch, SECRET)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        start = time.perf_counter()
+        post_updates(server.server_address[1], updates, clients)
+        server.shutdown()
+        server.server_close()
+        # close() ждет, пока воркеры обработают все обновления
+        router.close()
+        elapsed = time.perf_counter() - start
+        return elapsed, count_replies(os.environ['BENCH_REPLIES'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--chats', type=int, default=32)
+    parser.add_argument('--cities-per-chat', type=int, default=3)
+    parser.add_argument('--clients', type=int, default=8)
+    args = parser.parse_args()
+
+    from config import DATABASE
+    cities = pick_cities(DATABASE, args.chats * args.cities_per_chat)
+    updates = make_updates(cities, args.chats, args.cities_per_chat)
+    print(f"ядер: {os.cpu_count()}, обновлений: {len(updates)}, чатов: {args.chats}")
+
+    baseline = None
+    for workers in args.workers:
+        elapsed, (maps, errors) = run(workers, DATABASE, updates, args.clients)
+        rate = len(updates) / elapsed
+        baseline = baseline or rate
+        print(f"воркеров: {workers:2d}  время: {elapsed:6.2f} с  "
+              f"{rate:7.1f} обн/с  ускорение: x{rate / baseline:.2f}  "
+              f"карт: {maps}, ошибок: {errors}")
+
+
+if __name__ == '__main__':
+    main()
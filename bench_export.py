@@ -0,0 +1,66 @@
+"""Сравнение экспорта карты в PNG, SVG, PDF и HTML: размер файла и время генерации.
+
+Запуск: python bench_export.py --cities 5 50 --style detailed
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from config import DATABASE
+from logic import DB_Map
+
+
+def pick_cities(database, count):
+    """Берет самые крупные города с разными цветами маркеров"""
+    colors = ['red', 'blue', 'green', 'orange', 'purple']
+    conn = sqlite3.connect(database)
+    with conn:
+        rows = conn.execute('SELECT city FROM cities ORDER BY population DESC LIMIT ?',
+                            (count,)).fetchall()
+    return [(row[0], colors[i % len(colors)]) for i, row in enumerate(rows)]
+
+
+def measure(render, path):
+    start = time.perf_counter()
+    result = render(path)
+    elapsed = time.perf_counter() - start
+    if not result:
+        return None, elapsed
+    return os.path.getsize(path), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cities', type=int, nargs='+', default=[5, 50])
+    parser.add_argument('--style', default='detailed')
+    args = parser.parse_args()
+
+    manager = DB_Map(DATABASE)
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.cities:
+            cities_data = pick_cities(DATABASE, count)
+            print(f"Городов: {count}, стиль: {args.style}")
+            renders = {
+                'png': lambda path: manager.create_graph(path, cities_data, args.style),
+            }
+            for fmt in ('svg', 'pdf', 'html'):
+                renders[fmt] = (lambda fmt: lambda path: manager.export_map(
+                    path, cities_data, fmt, args.style))(fmt)
+
+            baseline = None
+            for fmt, render in renders.items():
+                size, elapsed = measure(render, os.path.join(directory, f'map_{count}.{fmt}'))
+                if size is None:
+                    print(f"  {fmt:4s} ошибка")
+                    continue
+                if fmt == 'png':
+                    baseline = size
+                # Без PNG сравнивать не с чем - выводим только размер
+                ratio = f"({size / baseline:5.2f} от PNG)" if baseline else ''
+                print(f"  {fmt:4s} {size / 1024:9.1f} КБ {ratio}  {elapsed:6.2f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+"""Сравнение webhook-режима с polling: задержка подтверждения и пропускная способность.
+
+Замер:             python bench_webhook.py --updates 300 --rate 100 --threads 2
+Прогон записи:     python bench_webhook.py --replay updates.json --url http://127.0.0.1:8443/ --secret <секрет>
+Проверка порядка:  python bench_webhook.py --check-order
+
+Обе стороны замера используют настоящий telebot с одинаковым числом потоков-обработчиков:
+polling - штатный bot.polling() (пул потоков telebot) против локальной имитации Bot API,
+webhook - WebhookServer и UpdateQueue с ботом в режиме threaded=False.
+
+Файл для --replay - JSON-массив обновлений Telegram или по одному обновлению на строку.
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import telebot
+from telebot import apihelper
+
+from webhook import SECRET_HEADER, UpdateQueue, WebhookServer
+
+SECRET = 'bench-secret'
+
+
+def simulated_handler(update):
+    """Имитирует обработчик бота - в основном ожидание ответа Telegram API"""
+    time.sleep(0.02)
+
+
+def make_update(update_id, chat_id, text='/show_my_cities'):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'Bench'},
+            'text': text,
+        },
+    }
+
+
+def load_updates(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def post(conn, path, update, secret):
+    conn.request('POST', path, json.dumps(update, ensure_ascii=False).encode('utf-8'),
+                 {'Content-Type': 'application/json', SECRET_HEADER: secret})
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def replay(url, updates, secret):
+    """Отправляет записанные обновления на локальный webhook по одному"""
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80)
+    for update in updates:
+        status = post(conn, parsed.path or '/', update, secret)
+        print(f"update_id={update.get('update_id')}: HTTP {status}")
+
+
+class FakeTelegram():
+    """Минимальная имитация getUpdates: хранит обновления до подтверждения через offset"""
+    def __init__(self):
+        self.pending = []
+        self.arrived = {}
+        self.acked = {}
+        self.condition = threading.Condition()
+
+    def push(self, update):
+        with self.condition:
+            self.arrived[update['update_id']] = time.perf_counter()
+            self.pending.append(update)
+            self.condition.notify_all()
+
+    def get_updates(self, offset, timeout, limit=100):
+        with self.condition:
+            now = time.perf_counter()
+            for update in self.pending:
+                if update['update_id'] < offset:
+                    self.acked.setdefault(update['update_id'], now)
+            self.pending = [u for u in self.pending if u['update_id'] >= offset]
+            if not self.pending:
+                self.condition.wait(timeout)
+            return self.pending[:limit]
+
+
+BENCH_TOKEN = '123456:bench'
+
+
+def make_fake_server(telegram):
+    """Локальная имитация Bot API для настоящего bot.polling()"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            method = parsed.path.rsplit('/', 1)[-1]
+            if method == 'getUpdates':
+                query = parse_qs(parsed.query)
+                # telebot не передает offset, пока он равен 0
+                offset = int(query.get('offset', ['0'])[0])
+                timeout = float(query.get('timeout', ['0'])[0])
+                result = telegram.get_updates(offset, timeout,
+                                              int(query.get('limit', ['100'])[0]))
+            elif method == 'getMe':
+                result = {'id': 123456, 'is_bot': True, 'first_name': 'Bench',
+                          'username': 'bench_bot'}
+            else:
+                result = True
+            body = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_POST = do_GET
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_bench_bot(threaded, threads, handled):
+    """Бот telebot с одним обработчиком, имитирующим работу"""
+    bench_bot = telebot.TeleBot(BENCH_TOKEN, threaded=threaded, num_threads=threads)
+
+    @bench_bot.message_handler(func=lambda message: True)
+    def handle(message):
+        simulated_handler(message)
+        handled.append(time.perf_counter())
+
+    return bench_bot
+
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError('обновления не обработаны за отведенное время')
+        time.sleep(0.01)
+
+
+def produce(updates, rate, send):
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    for i, update in enumerate(updates):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        send(update)
+
+
+def bench_polling(updates, rate, threads):
+    """Штатный bot.polling(): пачки getUpdates, обработчики в пуле потоков telebot"""
+    telegram = FakeTelegram()
+    server = make_fake_server(telegram)
+    apihelper.API_URL = f'http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}'
+    handled = []
+    polling_bot = make_bench_bot(True, threads, handled)
+
+    poller = threading.Thread(target=polling_bot.polling,
+                              kwargs={'interval': 0, 'timeout': 10, 'long_polling_timeout': 1},
+                              daemon=True)
+    start = time.perf_counter()
+    poller.start()
+    produce(updates, rate, telegram.push)
+    wait_for(lambda: len(handled) == len(updates))
+    # Подтверждение последней пачки приходит со следующим getUpdates
+    wait_for(lambda: len(telegram.acked) == len(updates))
+    elapsed = max(handled) - start
+    polling_bot.stop_bot()
+    poller.join()
+    server.shutdown()
+    apihelper.API_URL = None
+
+    latencies = [telegram.acked[u['update_id']] - telegram.arrived[u['update_id']]
+                 for u in updates]
+    return latencies, elapsed
+
+
+def bench_webhook(updates, rate, threads, connections):
+    """Webhook: ответ сразу после постановки в очередь, обработчики в потоках UpdateQueue"""
+    handled = []
+    webhook_bot = make_bench_bot(False, threads, handled)
+
+    def handler(update):
+        webhook_bot.process_new_updates([telebot.types.Update.de_json(update)])
+
+    queue = UpdateQueue(handler, threads, maxsize=len(updates))
+    server = WebhookServer(('127.0.0.1', 0), queue.dispatch, SECRET)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    local = threading.local()
+    latencies = []
+
+    def send(update):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection('127.0.0.1', port)
+        sent = time.perf_counter()
+        status = post(local.conn, '/', update, SECRET)
+        assert status == 200, status
+        latencies.append(time.perf_counter() - sent)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(connections) as pool:
+        produce(updates, rate, lambda update: pool.submit(send, update))
+    queue.join()
+    elapsed = max(handled) - start
+    server.shutdown()
+    server.server_close()
+    queue.close()
+    return latencies, elapsed
+
+
+def check_order(database):
+    """Проверяет, что два обновления одного чата проходят через bot.process_update по порядку"""
+    import bot as maps_bot
+
+    with tempfile.TemporaryDirectory() as directory:
+        copy = os.path.join(directory, 'database.db')
+        shutil.copy(database, copy)
+        maps_bot.setup(threaded=False, database=copy)
+
+        replies = []
+        maps_bot.bot.send_message = lambda chat_id, text, *args, **kwargs: \
+            replies.append(text.strip().split('\n')[0])
+
+        # Замедляем добавление: при параллельной обработке удаление успело бы раньше
+        add_city = maps_bot.manager.add_city
+
+        def slow_add_city(*args, **kwargs):
+            time.sleep(0.3)
+            return add_city(*args, **kwargs)
+
+        maps_bot.manager.add_city = slow_add_city
+
+        chat_id = 424242
+        queue = UpdateQueue(maps_bot.process_update, threads=4, maxsize=10)
+        queue.dispatch(make_update(1, chat_id, '/remember_city London'))
+        queue.dispatch(make_update(2, chat_id, '/forget_city London'))
+        queue.join()
+        queue.close()
+        left = maps_bot.manager.select_cities(chat_id)
+
+    expected = ['✅ ГОРОД ДОБАВЛЕН!', '✅ ГОРОД УДАЛЕН!']
+    if replies != expected or left:
+        print(f"❌ Порядок нарушен: ответы {replies}, осталось городов: {left}")
+        return False
+    print("✅ Обновления одного чата обработаны по порядку")
+    return True
+
+
+def report(name, latencies, elapsed, count):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:8s} подтверждение: медиана {statistics.median(latencies) * 1000:7.1f} мс, "
+          f"p95 {p95 * 1000:7.1f} мс  |  {count / elapsed:6.1f} обн/с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=300)
+    parser.add_argument('--rate', type=float, default=100, help='обновлений в секунду')
+    parser.add_argument('--chats', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=2,
+                        help='потоков-обработчиков в обоих режимах (в telebot по умолчанию 2)')
+    parser.add_argument('--connections', type=int, default=1,
+                        help='одновременных соединений к webhook (Telegram использует до 40)')
+    parser.add_argument('--replay', help='файл с записанными обновлениями')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/')
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--check-order', action='store_true',
+                        help='проверить порядок обработки через настоящий bot.process_update')
+    args = parser.parse_args()
+
+    if args.check_order:
+        from config import DATABASE
+        raise SystemExit(0 if check_order(DATABASE) else 1)
+
+    if args.replay:
+        replay(args.url, load_updates(args.replay), args.secret)
+        return
+
+    updates = [make_update(i + 1, 1000 + i % args.chats) for i in range(args.updates)]
+    print(f"потоков-обработчиков: {args.threads}, соединений webhook: {args.connections}")
+    report('polling', *bench_polling(updates, args.rate, args.threads), args.updates)
+    report('webhook', *bench_webhook(updates, args.rate, args.threads, args.connections),
+           args.updates)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,19 @@
 import telebot
 from config import *
 from logic import *
+from render_cache import RenderCache
+from prerender import Prerenderer
+import argparse
 import os
 import tempfile
 from datetime import datetime
+from urllib.parse import urlparse
 
 bot = telebot.TeleBot(TOKEN)
+render_cache = RenderCache(os.environ.get('RENDER_CACHE_DIR'))
+
+# Стиль карты, который заранее рисуется в фоне после изменения списка городов
+PRERENDER_STYLE = 'detailed'
 
 # Доступные цвета маркеров
 AVAILABLE_COLORS = {
@@ -21,6 +29,38 @@ AVAILABLE_COLORS = {
     'white': '⚪ Белый'
 }
 
+# Форматы экспорта карты
+EXPORT_FORMATS = {
+    'svg': '📐 Векторная карта (SVG)',
+    'pdf': '📄 Карта для печати (PDF)',
+    'html': '🌐 Интерактивная карта (HTML)'
+}
+
+def map_cache_key(cities_data, style, base_style='simple'):
+    # Подложка различает только тепловые карты
+    if style == 'heatmap':
+        return render_cache.key('graph', style, base_style, cities_data)
+    return render_cache.key('graph', style, cities_data)
+
+
+def render_map(cities_data, style, base_style='simple'):
+    """Возвращает путь к карте из общего кэша, рисуя ее при необходимости"""
+    return render_cache.get_or_render(
+        map_cache_key(cities_data, style, base_style), '.png',
+        lambda path: manager.create_graph(path, cities_data, style, base_style))
+
+
+def prerender_user_map(user_id):
+    """Заранее рисует карту пользователя, чтобы /map_detailed ответил сразу"""
+    cities_data = manager.get_cities_with_colors(user_id)
+    if cities_data:
+        render_map(cities_data, PRERENDER_STYLE)
+
+
+# Блокировки фонового рендера рядом с общим кэшем - их видят все процессы бота
+prerenderer = Prerenderer(prerender_user_map,
+                          lock_dir=os.path.join(render_cache.directory, 'prerender'))
+
 @bot.message_handler(commands=['start'])
 def handle_start(message):
     user_id = message.chat.id
@@ -74,6 +114,9 @@ def handle_help(message):
 /map_simple - простая карта
 /map_detailed - детальная карта
 /map_physical - физическая карта
+/map_heatmap [simple|detailed|physical] - тепловая карта (для большого числа городов)
+/map_timeline [gif|mp4] - анимация истории добавления городов
+/map_export <svg|pdf|html> - экспорт карты в файл
 
 📏 ДОПОЛНИТЕЛЬНО:
 /show_city <город> - показать один город
@@ -163,6 +206,7 @@ def handle_set_color(message):
             
         success = manager.set_marker_color(message.chat.id, city_name, color)
         if success:
+            prerenderer.schedule(message.chat.id)
             bot.send_message(message.chat.id, 
                 f"✅ ЦВЕТ ИЗМЕНЕН!\n\n"
                 f"🏙️ Город: {city_name}\n"
@@ -177,12 +221,22 @@ def handle_set_color(message):
     except Exception as e:
         bot.send_message(message.chat.id, f"❌ Ошибка: {str(e)}")
 
-@bot.message_handler(commands=['map_simple', 'map_detailed', 'map_physical'])
+@bot.message_handler(commands=['map_simple', 'map_detailed', 'map_physical', 'map_heatmap'])
 def handle_map_style(message):
     try:
-        command = message.text.split()[0]
-        style = command.replace('/map_', '')
+        parts = message.text.split()
+        style = parts[0].replace('/map_', '')
         user_id = message.chat.id
+        # Тепловая карта рисуется поверх выбранной подложки
+        base_style = parts[1].lower() if style == 'heatmap' and len(parts) > 1 else 'simple'
+
+        if base_style not in HEATMAP_BASE_STYLES:
+            bot.send_message(user_id,
+                "❌ НЕПРАВИЛЬНАЯ ПОДЛОЖКА\n\n"
+                "📝 Правильно: /map_heatmap [simple|detailed|physical]\n\n"
+                "🔹 Пример:\n"
+                "/map_heatmap physical")
+            return
         
         cities_data = manager.get_cities_with_colors(user_id)
         
@@ -195,11 +249,11 @@ def handle_map_style(message):
                 "/remember_city Tokyo")
             return
             
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as temp_file:
-            temp_path = temp_file.name
-        
-        bot.send_message(user_id, "🔄 Создаю вашу персональную карту...")
-        result = manager.create_graph(temp_path, cities_data, style)
+        # Карта с тем же набором городов и цветов могла уже быть нарисована
+        if not render_cache.cached_path(map_cache_key(cities_data, style, base_style), '.png'):
+            bot.send_message(user_id, "🔄 Создаю вашу персональную карту...")
+        with prerenderer.interactive():
+            result = render_map(cities_data, style, base_style)
         
         if not result:
             bot.send_message(user_id, "❌ Ошибка при создании карты")
@@ -208,10 +262,11 @@ def handle_map_style(message):
         style_names = {
             'simple': '🗺️ ПРОСТАЯ КАРТА',
             'detailed': '🗾 ДЕТАЛЬНАЯ КАРТА', 
-            'physical': '⛰️ ФИЗИЧЕСКАЯ КАРТА'
+            'physical': '⛰️ ФИЗИЧЕСКАЯ КАРТА',
+            'heatmap': '🔥 ТЕПЛОВАЯ КАРТА'
         }
         
-        with open(temp_path, 'rb') as photo:
+        with open(result, 'rb') as photo:
             caption = f"{style_names.get(style, 'КАРТА')}\n"
             caption += f"👤 Пользователь: {message.chat.first_name or 'Аноним'}\n"
             caption += f"🏙️ Городов: {len(cities_data)}\n"
@@ -219,8 +274,106 @@ def handle_map_style(message):
             
             bot.send_photo(user_id, photo, caption=caption)
         
+    except Exception as e:
+        bot.send_message(message.chat.id, f"❌ Ошибка: {str(e)}")
+
+@bot.message_handler(commands=['map_timeline'])
+def handle_map_timeline(message):
+    try:
+        parts = message.text.split()
+        fmt = parts[1].lower() if len(parts) > 1 else 'gif'
+        user_id = message.chat.id
+
+        if fmt not in ('gif', 'mp4'):
+            bot.send_message(user_id,
+                "❌ НЕПРАВИЛЬНЫЙ ФОРМАТ\n\n"
+                "📝 Правильно: /map_timeline [gif|mp4]\n\n"
+                "🔹 Пример:\n"
+                "/map_timeline mp4")
+            return
+
+        if not manager.find_ffmpeg():
+            bot.send_message(user_id,
+                "❌ Анимированные карты сейчас недоступны\n\n"
+                "💡 Посмотрите обычную карту:\n"
+                "/map_detailed")
+            return
+
+        timeline_data = manager.get_cities_timeline(user_id)
+
+        if not timeline_data:
+            bot.send_message(user_id,
+                "❌ У ВАС НЕТ СОХРАНЕННЫХ ГОРОДОВ\n\n"
+                "💡 Добавьте первый город:\n"
+                "/remember_city London")
+            return
+
+        with tempfile.NamedTemporaryFile(suffix=f'.{fmt}', delete=False) as temp_file:
+            temp_path = temp_file.name
+
+        bot.send_message(user_id, "🔄 Создаю анимацию ваших путешествий...")
+        with prerenderer.interactive():
+            result = manager.create_timeline(temp_path, timeline_data, fmt)
+
+        if result:
+            with open(temp_path, 'rb') as animation:
+                bot.send_animation(user_id, animation,
+                                   caption=f"🕓 ИСТОРИЯ ПУТЕШЕСТВИЙ\n"
+                                           f"🏙️ Городов: {len(timeline_data)}")
+        else:
+            bot.send_message(user_id, "❌ Ошибка при создании анимации")
+
         os.unlink(temp_path)
-        
+
+    except Exception as e:
+        bot.send_message(message.chat.id, f"❌ Ошибка: {str(e)}")
+
+@bot.message_handler(commands=['map_export'])
+def handle_map_export(message):
+    try:
+        parts = message.text.split()
+        user_id = message.chat.id
+        fmt = parts[1].lower() if len(parts) > 1 else ''
+        style = parts[2].lower() if len(parts) > 2 else 'detailed'
+
+        # Стиль влияет только на SVG/PDF; physical с растровой подложкой для них недоступен
+        if fmt not in EXPORT_FORMATS or style not in VECTOR_EXPORT_STYLES:
+            bot.send_message(user_id,
+                "❌ НЕПРАВИЛЬНЫЙ ФОРМАТ\n\n"
+                "📝 Правильно: /map_export <svg|pdf|html> [simple|detailed]\n\n"
+                "🔹 Примеры:\n"
+                "/map_export svg\n"
+                "/map_export pdf simple\n"
+                "/map_export html")
+            return
+
+        cities_data = manager.get_cities_with_colors(user_id)
+
+        if not cities_data:
+            bot.send_message(user_id,
+                "❌ У ВАС НЕТ СОХРАНЕННЫХ ГОРОДОВ\n\n"
+                "💡 Добавьте первый город:\n"
+                "/remember_city London")
+            return
+
+        style_key = style if fmt != 'html' else 'html'
+        cache_key = render_cache.key('export', fmt, style_key, cities_data)
+        if not render_cache.cached_path(cache_key, f'.{fmt}'):
+            bot.send_message(user_id, "🔄 Экспортирую карту...")
+        with prerenderer.interactive():
+            result = render_cache.get_or_render(
+                cache_key, f'.{fmt}', lambda path: manager.export_map(path, cities_data, fmt, style))
+
+        if not result:
+            bot.send_message(user_id, "❌ Ошибка при экспорте карты")
+            return
+
+        # Файл передается потоком, без чтения в память целиком
+        with open(result, 'rb') as document:
+            bot.send_document(user_id, document, visible_file_name=f'map.{fmt}',
+                              caption=f"{EXPORT_FORMATS[fmt]}\n"
+                                      f"🏙️ Городов: {len(cities_data)}")
+
     except Exception as e:
         bot.send_message(message.chat.id, f"❌ Ошибка: {str(e)}")
 
@@ -244,6 +397,7 @@ def handle_remember_city(message):
         success, found_city = manager.add_city(user_id, city_name)
         
         if success == 1:
+            prerenderer.schedule(user_id)
             bot.send_message(user_id, 
                 f"✅ ГОРОД ДОБАВЛЕН!\n\n"
                 f"🏙️ Город: {found_city or city_name}\n"
@@ -290,6 +444,7 @@ def handle_forget_city(message):
         success = manager.remove_city(user_id, city_name)
         
         if success:
+            prerenderer.schedule(user_id)
             bot.send_message(user_id, 
                 f"✅ ГОРОД УДАЛЕН!\n\n"
                 f"🏙️ Город: {city_name}\n"
@@ -356,7 +511,8 @@ def handle_show_city(message):
             temp_path = temp_file.name
         
         bot.send_message(user_id, "🔄 Создаю карту...")
-        result = manager.create_graph(temp_path, [city_name], 'detailed')
+        with prerenderer.interactive():
+            result = manager.create_graph(temp_path, [city_name], 'detailed')
         
         if result:
             with open(temp_path, 'rb') as photo:
@@ -437,7 +593,9 @@ def handle_distance(message):
             temp_path = temp_file.name
         
         bot.send_message(user_id, "🔄 Рассчитываю расстояние...")
-        if manager.draw_distance(city1, city2, temp_path):
+        with prerenderer.interactive():
+            result = manager.draw_distance(city1, city2, temp_path)
+        if result:
             with open(temp_path, 'rb') as photo:
                 bot.send_photo(user_id, photo, 
                               caption=f"📏 РАССТОЯНИЕ\n\n"
@@ -459,12 +617,71 @@ def handle_unknown(message):
         "💡 Используйте /help для просмотра всех команд\n"
         "🔹 Или начните с /start")
 
+def setup(threaded=True, database=DATABASE):
+    """Подключает базу данных (в каждом процессе бота)
+
+    threaded=False - обработчики выполняются прямо в process_update, а не в
+    собственном пуле потоков telebot. Нужно для webhook-режимов: очередь и
+    порядок обновлений одного чата обеспечиваем мы сами.
+    """
+    global manager
+    # telebot проверяет этот флаг при запуске каждого обработчика
+    bot.threaded = threaded
+    manager = DB_Map(database)
+    manager.create_user_table()
+
+
+def setup_worker():
+    """Подготовка процесса-воркера в режиме --workers"""
+    setup(threaded=False)
+
+
+def process_update(update_json):
+    """Передает одно обновление Telegram в обработчики бота (после setup(threaded=False) - синхронно)"""
+    bot.process_new_updates([telebot.types.Update.de_json(update_json)])
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Картографический бот Telegram')
+    parser.add_argument('--webhook', action='store_true',
+                        help='принимать обновления через webhook вместо polling')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='число потоков-обработчиков в webhook-режиме')
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help='размер очереди обновлений на поток или воркер в webhook-режиме')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='число процессов-воркеров (webhook-режим с шардированием по chat.id)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--webhook-url', default=os.environ.get('WEBHOOK_URL', ''),
+                        help='публичный адрес, который будет зарегистрирован в Telegram')
+    parser.add_argument('--secret', default=os.environ.get('WEBHOOK_SECRET', ''),
+                        help='секретный токен для заголовка X-Telegram-Bot-Api-Secret-Token')
+    args = parser.parse_args()
+
     print("🔄 Запуск бота для всех пользователей...")
     print("🗃️ Инициализация базы данных...")
-    manager = DB_Map(DATABASE)
-    manager.create_user_table()
+    setup(threaded=not args.webhook and args.workers == 0)
     print("✅ База данных готова")
     print("👥 Бот доступен для ВСЕХ пользователей!")
-    print("🚀 Запускаю polling...")
-    bot.polling()
\ No newline at end of file
+
+    if (args.webhook or args.workers > 0) and args.webhook_url:
+        bot.remove_webhook()
+        bot.set_webhook(url=args.webhook_url, secret_token=args.secret or None)
+
+    # Сервер принимает обновления только по пути из зарегистрированного адреса
+    webhook_path = urlparse(args.webhook_url).path or '/'
+
+    if args.workers > 0:
+        from cluster import run_cluster
+        print("🚀 Запускаю webhook с воркерами...")
+        run_cluster(args.workers, args.host, args.port, args.secret, webhook_path,
+                    maxsize=args.queue_size)
+    elif args.webhook:
+        from webhook import run_webhook
+        print("🚀 Запускаю webhook...")
+        run_webhook(args.host, args.port, process_update, args.secret, webhook_path,
+                    threads=args.threads, maxsize=args.queue_size)
+    else:
+        print("🚀 Запускаю polling...")
+        bot.polling()
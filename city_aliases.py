@@ -0,0 +1,52 @@
+# Начальные псевдонимы городов: название в базе -> местные названия и транслитерации.
+# Загружаются в таблицу city_aliases при запуске бота. Псевдоним не должен совпадать
+# с названием другого города в cities (например, Moskva, Roma, Vienne - реальные города).
+CITY_ALIASES = {
+    'Moscow': ['Москва', 'Moskau', 'Moscou', 'Mosca'],
+    'Saint Petersburg': ['Санкт-Петербург', 'Петербург', 'Питер', 'Sankt-Peterburg',
+                         'St Petersburg', 'Sankt Petersburg'],
+    'Nizhniy Novgorod': ['Нижний Новгород', 'Nizhny Novgorod', 'Nizhnii Novgorod'],
+    'Yekaterinburg': ['Екатеринбург', 'Ekaterinburg', 'Jekaterinburg'],
+    'Novosibirsk': ['Новосибирск'],
+    'Kazan': ['Казань', "Kazan'"],
+    'Kyiv': ['Киев', 'Київ', 'Kiev', 'Kyjiw', 'Kijów'],
+    'Minsk': ['Минск', 'Мінск', 'Mensk'],
+    'Almaty': ['Алматы', 'Алма-Ата', 'Alma-Ata'],
+    'Tashkent': ['Ташкент', 'Toshkent'],
+    'Tbilisi': ['Тбилиси', 'თბილისი', 'Tiflis'],
+    'Yerevan': ['Ереван', 'Երևան', 'Erevan'],
+    'Baku': ['Баку', 'Bakı'],
+    'London': ['Лондон', 'Londres', 'Londra'],
+    'Paris': ['Париж'],
+    'Berlin': ['Берлин', 'Berlino'],
+    'Munich': ['Мюнхен', 'München', 'Muenchen', 'Monaco di Baviera'],
+    'Cologne': ['Кёльн', 'Кельн', 'Köln', 'Koeln'],
+    'Nuremberg': ['Нюрнберг', 'Nürnberg', 'Nuernberg'],
+    'Vienna': ['Вена', 'Wien'],
+    'Prague': ['Прага', 'Praha', 'Prag'],
+    'Warsaw': ['Варшава', 'Warszawa', 'Warschau'],
+    'Rome': ['Рим'],
+    'Milan': ['Милан', 'Milano', 'Mailand'],
+    'Naples': ['Неаполь', 'Napoli', 'Neapel'],
+    'Florence': ['Флоренция', 'Firenze', 'Florenz'],
+    'Venice': ['Венеция', 'Venezia', 'Venedig'],
+    'Lisbon': ['Лиссабон', 'Lisboa', 'Lissabon'],
+    'Madrid': ['Мадрид'],
+    'Barcelona': ['Барселона'],
+    'Athens': ['Афины', 'Αθήνα', 'Athina', 'Athen'],
+    'Copenhagen': ['Копенгаген', 'København', 'Kobenhavn', 'Kopenhagen'],
+    'Brussels': ['Брюссель', 'Bruxelles', 'Brussel', 'Brüssel'],
+    'The Hague': ['Гаага', 'Den Haag', "'s-Gravenhage"],
+    'Geneva': ['Женева', 'Genève', 'Geneve', 'Genf'],
+    'Zurich': ['Цюрих', 'Zürich', 'Zuerich'],
+    'Belgrade': ['Белград', 'Beograd', 'Београд'],
+    'Bucharest': ['Бухарест', 'București', 'Bucuresti'],
+    'Sofia': ['София', 'Sofiya'],
+    'Istanbul': ['Стамбул', 'İstanbul', 'Constantinople'],
+    'Beijing': ['Пекин', '北京', 'Peking'],
+    'Tokyo': ['Токио', '東京', 'Tōkyō'],
+    'Seoul': ['Сеул', '서울'],
+    'Cairo': ['Каир', 'القاهرة', 'Le Caire'],
+    'New York': ['Нью-Йорк', 'NYC', 'New York City'],
+    'Mexico City': ['Мехико', 'Ciudad de México', 'Ciudad de Mexico', 'CDMX'],
+}
@@ -0,0 +1,166 @@
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+
+from webhook import WebhookServer, extract_chat_id, shard_for
+
+
+def load_callable(path):
+    """Загружает функцию по строке вида 'module:function'"""
+    module_name, name = path.split(':')
+    return getattr(importlib.import_module(module_name), name)
+
+
+def worker_main(socket_path, handler_path, setup_path=None):
+    """Процесс-воркер: последовательно обрабатывает обновления из своего UNIX-сокета"""
+    if setup_path:
+        load_callable(setup_path)()
+    handler = load_callable(handler_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    conn, _ = server.accept()
+    server.close()
+
+    # Одна строка - одно обновление в JSON; EOF означает остановку
+    with conn, conn.makefile('rb') as stream:
+        for line in stream:
+            try:
+                handler(json.loads(line))
+            except Exception as e:
+                print(f"Ошибка в воркере {os.getpid()}: {e}")
+
+
+class ShardRouter():
+    """Запускает N воркеров и раздает им обновления по хэшу chat.id
+
+    У каждого воркера своя ограниченная очередь и поток-отправитель, поэтому
+    медленный воркер не блокирует HTTP-потоки: при переполненной очереди
+    dispatch возвращает False, и webhook отвечает 503. Упавший воркер
+    перезапускается при следующей отправке.
+    """
+    def __init__(self, workers, handler_path, setup_path=None, socket_dir=None, maxsize=100):
+        self.workers = workers
+        self.handler_path = handler_path
+        self.setup_path = setup_path
+        self.socket_dir = socket_dir or tempfile.mkdtemp(prefix='maps_cluster_')
+        self.processes = [None] * workers
+        self.connections = [None] * workers
+        self.queues = [queue.Queue(maxsize) for _ in range(workers)]
+
+        for index in range(workers):
+            self.start_worker(index)
+        self.senders = [threading.Thread(target=self.send_loop, args=(index,), daemon=True)
+                        for index in range(workers)]
+        for sender in self.senders:
+            sender.start()
+
+    def socket_path(self, index):
+        return os.path.join(self.socket_dir, f'worker_{index}.sock')
+
+    def start_worker(self, index):
+        socket_path = self.socket_path(index)
+        # Сокет от прежнего процесса помешал бы новому воркеру сделать bind
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        process = multiprocessing.Process(target=worker_main,
+                                          args=(socket_path, self.handler_path, self.setup_path),
+                                          daemon=True)
+        process.start()
+        self.processes[index] = process
+        self.connections[index] = self.connect(socket_path, process)
+
+    def restart_worker(self, index):
+        """Заменяет упавший или недоступный воркер новым процессом"""
+        old = self.processes[index]
+        print(f"⚠️ Воркер {index} (pid {old.pid}) недоступен, код выхода {old.exitcode}, перезапускаю")
+        self.connections[index].close()
+        if old.is_alive():
+            old.kill()
+        old.join()
+        while True:
+            try:
+                self.start_worker(index)
+                return
+            except OSError as e:
+                print(f"Не удалось запустить воркер {index}: {e}")
+                time.sleep(1)
+
+    def connect(self, socket_path, process, timeout=30):
+        # Ждем, пока воркер создаст свой сокет
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(socket_path)
+                return conn
+            except (FileNotFoundError, ConnectionRefusedError):
+                conn.close()
+                # Воркер упал еще при запуске - ждать сокет бессмысленно
+                if not process.is_alive():
+                    raise ConnectionRefusedError(
+                        f'воркер завершился при запуске, код выхода {process.exitcode}')
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def dispatch(self, update):
+        """Ставит обновление в очередь воркера; False, если очередь переполнена"""
+        chat_id = extract_chat_id(update)
+        index = shard_for(chat_id, self.workers) if chat_id is not None else 0
+        line = json.dumps(update, ensure_ascii=False).encode('utf-8') + b'\n'
+        try:
+            self.queues[index].put_nowait(line)
+            return True
+        except queue.Full:
+            return False
+
+    def send_loop(self, index):
+        """Передает обновления из очереди воркеру; None означает остановку"""
+        updates = self.queues[index]
+        while True:
+            line = updates.get()
+            if line is None:
+                self.connections[index].close()
+                return
+            # Обновления, уже принятые упавшим воркером, потеряны; текущее отправляем новому
+            while True:
+                try:
+                    self.connections[index].sendall(line)
+                    break
+                except OSError:
+                    self.restart_worker(index)
+
+    def close(self):
+        """Отправляет остаток очередей и ждет, пока воркеры его обработают"""
+        for updates in self.queues:
+            updates.put(None)
+        for sender in self.senders:
+            sender.join()
+        for process in self.processes:
+            process.join()
+        for name in os.listdir(self.socket_dir):
+            os.unlink(os.path.join(self.socket_dir, name))
+        os.rmdir(self.socket_dir)
+
+
+def run_cluster(workers, host, port, secret_token='', path='/', maxsize=100,
+                handler_path='bot:process_update', setup_path='bot:setup_worker'):
+    """Webhook-приемник в главном процессе и N процессов-воркеров бота"""
+    router = ShardRouter(workers, handler_path, setup_path, maxsize=maxsize)
+    server = WebhookServer((host, port), router.dispatch, secret_token, path)
+    print(f"🧩 Запущено воркеров: {workers}, webhook слушает {host}:{port}{path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        router.close()
@@ -1,18 +1,163 @@
 import sqlite3
 from config import *
+from city_aliases import CITY_ALIASES
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
+import shapely.geometry as sgeom
 import warnings
+import functools
+import json
+import math
 import os
+import shutil
+import subprocess
 
 warnings.filterwarnings('ignore')
 
+# Размер кэша в памяти перед таблицей city_aliases (хранит и промахи)
+CITY_LOOKUP_CACHE_SIZE = 4096
+
+# Масштаб Natural Earth для векторного экспорта (SVG/PDF)
+VECTOR_EXPORT_SCALE = '110m'
+# Размер ячейки тепловой карты в градусах - число ячеек зависит от охвата карты
+HEATMAP_CELL_DEGREES = 0.5
+# Стили подложки, доступные для тепловой карты
+HEATMAP_BASE_STYLES = ('simple', 'detailed', 'physical')
+# Стили без растровой подложки - только они остаются компактными в SVG/PDF
+VECTOR_EXPORT_STYLES = ('simple', 'detailed')
+
+# Страница для экспорта в HTML: полностью автономная, без внешних скриптов и тайлов.
+# Подложка - встроенный SVG из той же геометрии Natural Earth, что и у SVG/PDF,
+# города - встроенный GeoJSON; перетаскивание и масштаб колесом как в Leaflet.
+HTML_MAP_TEMPLATE = '''<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Карта городов ({count})</title>
+<style>
+html, body {{ height: 100%; margin: 0; background: #e0f0ff; font-family: sans-serif; }}
+#map {{ display: block; width: 100%; height: 100%; cursor: grab; touch-action: none; }}
+.land {{ fill: #f5f5f5; stroke: #333333; stroke-width: 0.8; vector-effect: non-scaling-stroke; }}
+.border {{ fill: none; stroke: #666666; stroke-width: 0.5; stroke-dasharray: 4 3; vector-effect: non-scaling-stroke; }}
+.city {{ stroke: black; stroke-width: 2; fill-opacity: 0.8; vector-effect: non-scaling-stroke; }}
+.label {{ font-weight: bold; paint-order: stroke; stroke: white; stroke-width: 3px; stroke-linejoin: round; }}
+</style>
+</head>
+<body>
+<svg id="map" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" preserveAspectRatio="xMidYMid meet">
+<path class="land" d="{land}"/>
+<path class="border" d="{borders}"/>
+<g id="cities"></g>
+</svg>
+<script>
+var cities = {data};
+var extent = {extent};
+var scale = {scale};
+var svg = document.getElementById('map');
+var layer = document.getElementById('cities');
+var view = {{x: 0, y: 0, w: {width}, h: {height}}};
+var NS = 'http://www.w3.org/2000/svg';
+
+function project(lon, lat) {{
+    return [(lon - extent[0]) * scale, (extent[3] - lat) * scale];
+}}
+
+// Маркеры и подписи сохраняют экранный размер при любом масштабе
+var markers = cities.features.map(function (feature) {{
+    var p = project(feature.geometry.coordinates[0], feature.geometry.coordinates[1]);
+    var circle = document.createElementNS(NS, 'circle');
+    circle.setAttribute('class', 'city');
+    circle.setAttribute('cx', p[0]);
+    circle.setAttribute('cy', p[1]);
+    circle.setAttribute('fill', feature.properties.color);
+    var title = document.createElementNS(NS, 'title');
+    title.textContent = feature.properties.name;
+    circle.appendChild(title);
+    var label = document.createElementNS(NS, 'text');
+    label.setAttribute('class', 'label');
+    label.textContent = feature.properties.name;
+    layer.appendChild(circle);
+    layer.appendChild(label);
+    return {{p: p, circle: circle, label: label}};
+}});
+
+function unitsPerPixel() {{
+    var rect = svg.getBoundingClientRect();
+    return Math.max(view.w / rect.width, view.h / rect.height);
+}}
+
+function render() {{
+    svg.setAttribute('viewBox', [view.x, view.y, view.w, view.h].join(' '));
+    var k = unitsPerPixel();
+    markers.forEach(function (m) {{
+        m.circle.setAttribute('r', 7 * k);
+        m.label.setAttribute('x', m.p[0] + 10 * k);
+        m.label.setAttribute('y', m.p[1] - 6 * k);
+        m.label.setAttribute('font-size', 13 * k);
+    }});
+}}
+
+var drag = null;
+svg.addEventListener('pointerdown', function (e) {{
+    drag = {{x: e.clientX, y: e.clientY}};
+    svg.setPointerCapture(e.pointerId);
+    svg.style.cursor = 'grabbing';
+}});
+svg.addEventListener('pointermove', function (e) {{
+    if (!drag) return;
+    var k = unitsPerPixel();
+    view.x -= (e.clientX - drag.x) * k;
+    view.y -= (e.clientY - drag.y) * k;
+    drag = {{x: e.clientX, y: e.clientY}};
+    render();
+}});
+svg.addEventListener('pointerup', function () {{
+    drag = null;
+    svg.style.cursor = 'grab';
+}});
+svg.addEventListener('wheel', function (e) {{
+    e.preventDefault();
+    var point = svg.createSVGPoint();
+    point.x = e.clientX;
+    point.y = e.clientY;
+    var at = point.matrixTransform(svg.getScreenCTM().inverse());
+    var factor = e.deltaY < 0 ? 0.8 : 1.25;
+    view.x = at.x - (at.x - view.x) * factor;
+    view.y = at.y - (at.y - view.y) * factor;
+    view.w *= factor;
+    view.h *= factor;
+    render();
+}}, {{passive: false}});
+window.addEventListener('resize', render);
+render();
+</script>
+</body>
+</html>
+'''
+
+# Пикселей на градус в SVG-подложке HTML-экспорта
+HTML_MAP_SCALE = 10
+
+# Ограничения для анимированной карты, чтобы стоимость рендера была предсказуемой
+TIMELINE_MAX_FRAMES = 120
+TIMELINE_MAX_SECONDS = 15
+TIMELINE_FPS = 8
+TIMELINE_HOLD_FRAMES = 8
+
 class DB_Map():
     def __init__(self, database):
         self.database = database
+        # Кэшируем и отрицательные результаты, чтобы повторный неверный ввод не шел в базу
+        self.resolve_city = functools.lru_cache(maxsize=CITY_LOOKUP_CACHE_SIZE)(self.lookup_city)
+        # Подсказки для неверного ввода - LIKE по всей таблице cities, тоже кэшируем
+        self.find_city_variants = functools.lru_cache(
+            maxsize=CITY_LOOKUP_CACHE_SIZE)(self.search_city_variants)
         self.init_database()
     
     def init_database(self):
@@ -21,10 +166,24 @@ class DB_Map():
         if not os.path.exists(self.database):
             print("База данных не найдена, создаем новую...")
             self.create_database()
+        self.enable_wal()
+        # Один раз при запуске, а не на каждый /start
+        self.create_alias_table()
+
+    def connect(self):
+        """Открывает соединение с базой (ждет, если базу пишет другой процесс)"""
+        return sqlite3.connect(self.database, timeout=30)
+
+    def enable_wal(self):
+        """Включает WAL, чтобы несколько процессов бота могли читать во время записи"""
+        conn = self.connect()
+        with conn:
+            # Режим WAL сохраняется в самом файле базы
+            conn.execute('PRAGMA journal_mode=WAL')
     
     def create_database(self):
         """Создает базу данных с необходимой структурой"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             # Создаем таблицу пользователей и городов
             conn.execute('''CREATE TABLE IF NOT EXISTS users_cities (
@@ -44,7 +203,7 @@ class DB_Map():
 
     def create_user_table(self):
         """Создает таблицу для пользователей (обратная совместимость)"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             conn.execute('''CREATE TABLE IF NOT EXISTS users_cities (
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -55,35 +214,117 @@ class DB_Map():
                                 UNIQUE(user_id, city_id)
                             )''')
             conn.commit()
+        self.migrate_users_cities()
         print("Таблица users_cities готова")
 
+    def migrate_users_cities(self):
+        """Добавляет колонку created_at в старые базы, где ее еще нет"""
+        conn = self.connect()
+        with conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(users_cities)")]
+            if 'created_at' not in columns:
+                # ALTER TABLE не допускает DEFAULT CURRENT_TIMESTAMP,
+                # поэтому дату добавления проставляем явно при вставке
+                conn.execute('''ALTER TABLE users_cities ADD COLUMN created_at TIMESTAMP''')
+                conn.commit()
+                print("В users_cities добавлена колонка created_at")
+
+    def create_alias_table(self):
+        """Создает таблицу псевдонимов городов и заполняет ее начальными значениями"""
+        conn = self.connect()
+        with conn:
+            has_cities = conn.execute("""SELECT 1 FROM sqlite_master
+                                        WHERE type='table' AND name='cities'""").fetchone()
+            if not has_cities:
+                return
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS city_aliases (
+                                alias TEXT PRIMARY KEY,
+                                city_id INTEGER NOT NULL
+                            )''')
+            # Без индекса каждый поиск по названию - полный просмотр cities
+            conn.execute('''CREATE INDEX IF NOT EXISTS idx_cities_city
+                          ON cities(city)''')
+            cursor = conn.cursor()
+            for city, aliases in CITY_ALIASES.items():
+                target = self.find_exact_city(cursor, city)
+                if not target:
+                    continue
+                cursor.executemany('''INSERT OR IGNORE INTO city_aliases (alias, city_id)
+                                   VALUES (?, ?)''',
+                                   [(self.normalize_city_name(alias), target[0])
+                                    for alias in aliases])
+
+            # Псевдоним, совпадающий с названием другого города, сделал бы тот город
+            # недоступным для добавления и удаления - такие записи убираем
+            rows = cursor.execute('''SELECT alias, city_id FROM city_aliases''').fetchall()
+            for alias, city_id in rows:
+                found = self.find_exact_city(cursor, alias)
+                if found and found[0] != city_id:
+                    cursor.execute('''DELETE FROM city_aliases WHERE alias=?''', (alias,))
+            conn.commit()
+        self.resolve_city.cache_clear()
+
+    def normalize_city_name(self, city_name):
+        """Приводит ввод пользователя к ключу таблицы псевдонимов"""
+        return ' '.join(city_name.split()).casefold()
+
+    def find_exact_city(self, cursor, city_name):
+        """Точное совпадение с одним из вариантов написания, одним запросом по индексу"""
+        city_name = ' '.join(city_name.split())
+        search_variants = [
+            city_name,
+            city_name.title(),
+            city_name.upper(),
+            city_name.lower()
+        ]
+        cursor.execute('''SELECT id, city FROM cities
+                        WHERE city IN (?, ?, ?, ?)
+                        ORDER BY CASE city WHEN ? THEN 0 WHEN ? THEN 1
+                                           WHEN ? THEN 2 ELSE 3 END, id
+                        LIMIT 1''', search_variants + search_variants[:3])
+        return cursor.fetchone()
+
+    def lookup_city(self, city_name):
+        """Находит город по свободному вводу, возвращает (city_id, город) или None"""
+        alias = self.normalize_city_name(city_name)
+        if not alias:
+            return None
+
+        conn = self.connect()
+        with conn:
+            cursor = conn.cursor()
+
+            # Сначала таблица псевдонимов: ранее найденные вводы и местные названия
+            cursor.execute('''SELECT cities.id, cities.city FROM city_aliases
+                            JOIN cities ON city_aliases.city_id = cities.id
+                            WHERE city_aliases.alias = ?''', (alias,))
+            result = cursor.fetchone()
+            if result:
+                return result
+
+            # Затем точное совпадение с одним из вариантов написания
+            result = self.find_exact_city(cursor, city_name)
+            if result:
+                # Запоминаем ввод, чтобы в следующий раз найти его сразу
+                cursor.execute('''INSERT OR IGNORE INTO city_aliases (alias, city_id)
+                               VALUES (?, ?)''', (alias, result[0]))
+                conn.commit()
+            return result
+
     def add_city(self, user_id, city_name, marker_color='red'):
         """Добавляет город для пользователя"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             cursor = conn.cursor()
             
-            # Ищем город в базе (пробуем разные варианты написания)
-            search_variants = [
-                city_name,
-                city_name.title(),
-                city_name.upper(),
-                city_name.lower()
-            ]
-            
-            city_id = None
-            found_city = None
-            
-            for variant in search_variants:
-                cursor.execute("SELECT id, city FROM cities WHERE city=?", (variant,))
-                result = cursor.fetchone()
-                if result:
-                    city_id, found_city = result
-                    break
+            # Ищем город через псевдонимы и варианты написания
+            found = self.resolve_city(city_name)
+            city_id, found_city = found if found else (None, None)
             
             if city_id:
                 # Проверяем, не добавлен ли уже город
-                cursor.execute('''SELECT id FROM users_cities 
+                cursor.execute('''SELECT 1 FROM users_cities 
                                WHERE user_id=? AND city_id=?''', (user_id, city_id))
                 existing = cursor.fetchone()
                 
@@ -96,8 +337,8 @@ class DB_Map():
                     return 1, found_city
                 else:
                     # Добавляем новый город
-                    cursor.execute('''INSERT INTO users_cities (user_id, city_id, marker_color)
-                                   VALUES (?, ?, ?)''', (user_id, city_id, marker_color))
+                    cursor.execute('''INSERT INTO users_cities (user_id, city_id, marker_color, created_at)
+                                   VALUES (?, ?, ?, CURRENT_TIMESTAMP)''', (user_id, city_id, marker_color))
                     conn.commit()
                     return 1, found_city
             else:
@@ -105,13 +346,12 @@ class DB_Map():
 
     def set_marker_color(self, user_id, city_name, color):
         """Устанавливает цвет маркера для города пользователя"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             cursor = conn.cursor()
             
             # Находим city_id по названию города
-            cursor.execute("SELECT id FROM cities WHERE city=?", (city_name,))
-            city_data = cursor.fetchone()
+            city_data = self.resolve_city(city_name)
             
             if city_data:
                 city_id = city_data[0]
@@ -124,15 +364,15 @@ class DB_Map():
                     return True
                 else:
                     # Если запись не найдена, создаем ее
-                    cursor.execute('''INSERT INTO users_cities (user_id, city_id, marker_color)
-                                   VALUES (?, ?, ?)''', (user_id, city_id, color))
+                    cursor.execute('''INSERT INTO users_cities (user_id, city_id, marker_color, created_at)
+                                   VALUES (?, ?, ?, CURRENT_TIMESTAMP)''', (user_id, city_id, color))
                     conn.commit()
                     return True
             return False
 
     def get_cities_with_colors(self, user_id):
         """Возвращает список городов пользователя с цветами"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             cursor = conn.cursor()
             cursor.execute('''SELECT cities.city, users_cities.marker_color 
@@ -142,9 +382,23 @@ class DB_Map():
                             ORDER BY users_cities.created_at DESC''', (user_id,))
             return cursor.fetchall()
 
+    def get_cities_timeline(self, user_id):
+        """Возвращает города пользователя в порядке добавления (город, цвет, дата)"""
+        conn = self.connect()
+        with conn:
+            cursor = conn.cursor()
+            # Записи без даты (из старых баз) идут первыми в порядке вставки
+            cursor.execute('''SELECT cities.city, users_cities.marker_color, users_cities.created_at
+                            FROM users_cities
+                            JOIN cities ON users_cities.city_id = cities.id
+                            WHERE users_cities.user_id = ?
+                            ORDER BY users_cities.created_at IS NOT NULL,
+                                     users_cities.created_at, users_cities.rowid''', (user_id,))
+            return cursor.fetchall()
+
     def select_cities(self, user_id):
         """Возвращает список городов пользователя (обратная совместимость)"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             cursor = conn.cursor()
             cursor.execute('''SELECT cities.city 
@@ -155,15 +409,15 @@ class DB_Map():
 
     def get_coordinates(self, city_name):
         """Возвращает координаты города"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             cursor = conn.cursor()
             cursor.execute('''SELECT lat, lng FROM cities WHERE city = ?''', (city_name,))
             return cursor.fetchone()
 
-    def find_city_variants(self, city_name):
-        """Поиск похожих названий городов"""
-        conn = sqlite3.connect(self.database)
+    def search_city_variants(self, city_name):
+        """Поиск похожих названий городов (без кэша, см. find_city_variants)"""
+        conn = self.connect()
         with conn:
             cursor = conn.cursor()
             cursor.execute('''SELECT city FROM cities 
@@ -172,15 +426,15 @@ class DB_Map():
                             OR city LIKE ?
                             LIMIT 15''', 
                           (f'%{city_name}%', f'{city_name}%', f'%{city_name}'))
-            return [row[0] for row in cursor.fetchall()]
+            # Кортеж: результат хранится в кэше и не должен меняться вызывающим кодом
+            return tuple(row[0] for row in cursor.fetchall())
 
     def remove_city(self, user_id, city_name):
         """Удаляет город из списка пользователя"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             cursor = conn.cursor()
-            cursor.execute('''SELECT id FROM cities WHERE city=?''', (city_name,))
-            city_data = cursor.fetchone()
+            city_data = self.resolve_city(city_name)
             
             if city_data:
                 city_id = city_data[0]
@@ -192,7 +446,7 @@ class DB_Map():
 
     def get_user_stats(self, user_id):
         """Возвращает статистику пользователя"""
-        conn = sqlite3.connect(self.database)
+        conn = self.connect()
         with conn:
             cursor = conn.cursor()
             cursor.execute('''SELECT COUNT(*) FROM users_cities WHERE user_id=?''', (user_id,))
@@ -207,97 +461,404 @@ class DB_Map():
                 'unique_colors': unique_colors
             }
 
-    def create_graph(self, path, cities_data, map_style='detailed'):
-        """Создает карту с городами"""
+    def get_coordinates_bulk(self, city_names):
+        """Возвращает координаты сразу для многих городов одним проходом по базе"""
+        names = list(dict.fromkeys(city_names))
+        coords = {}
+        conn = self.connect()
+        with conn:
+            cursor = conn.cursor()
+            # SQLite ограничивает число параметров в одном запросе
+            for start in range(0, len(names), 500):
+                chunk = names[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f'''SELECT city, lat, lng FROM cities
+                                WHERE city IN ({placeholders})
+                                ORDER BY id''', chunk)
+                for city, lat, lng in cursor.fetchall():
+                    # Как и get_coordinates, берем первое совпадение
+                    coords.setdefault(city, (lat, lng))
+        return coords
+
+    def collect_coordinates(self, cities_data):
+        """Собирает (город, широта, долгота, цвет) для списка городов"""
+        items = []
+        for city_item in cities_data:
+            if isinstance(city_item, tuple):
+                city_name, color = city_item[0], city_item[1]
+            else:
+                city_name, color = city_item, 'red'
+            items.append((city_name, color))
+
+        coords = self.get_coordinates_bulk([city_name for city_name, _ in items])
+        city_coords = []
+        for city_name, color in items:
+            if city_name in coords:
+                lat, lon = coords[city_name]
+                city_coords.append((city_name, lat, lon, color))
+        return city_coords
+
+    def draw_basemap(self, ax, map_style='detailed', scale=None, extent=None):
+        """Рисует подложку карты в выбранном стиле
+
+        scale - масштаб Natural Earth ('110m', '50m', '10m'); по умолчанию
+        cartopy подбирает его по размеру карты. С extent геометрия заранее
+        обрезается по границам карты и упрощается (для SVG/PDF).
+        """
+        def feature(base):
+            if extent:
+                # cartopy выводит пересекающие карту полигоны целиком, лишь под маской
+                # осей - в векторный файл попал бы весь океан и материки
+                return cfeature.ShapelyFeature(
+                    self.vector_geometries(base, extent, scale or VECTOR_EXPORT_SCALE),
+                    ccrs.PlateCarree(), **base.kwargs)
+            return base.with_scale(scale) if scale else base
+
+        # Разные стили карты
+        if map_style == 'detailed':
+            # Детальная карта с заливкой
+            ax.add_feature(feature(cfeature.LAND), color='#f5f5f5', alpha=0.9)
+            ax.add_feature(feature(cfeature.OCEAN), color='#e0f0ff', alpha=0.9)
+            ax.add_feature(feature(cfeature.COASTLINE), linewidth=0.8, color='#333333')
+            ax.add_feature(feature(cfeature.BORDERS), linestyle='--', linewidth=0.5, color='#666666')
+            ax.add_feature(feature(cfeature.LAKES), color='#e0f0ff', alpha=0.7)
+            ax.add_feature(feature(cfeature.RIVERS), color='#e0f0ff', linewidth=0.5)
+            
+        elif map_style == 'physical':
+            # Физическая карта
+            ax.stock_img()
+            ax.add_feature(feature(cfeature.COASTLINE), linewidth=1.2, color='#333333')
+            ax.add_feature(feature(cfeature.BORDERS), linestyle='-', linewidth=0.7, color='#555555')
+            
+        else:  # simple
+            # Простая карта
+            ax.add_feature(feature(cfeature.COASTLINE), linewidth=1, color='#000000')
+            ax.add_feature(feature(cfeature.BORDERS), linestyle=':', linewidth=0.7, color='#444444')
+
+    def map_extent(self, city_coords):
+        """Возвращает границы карты [lon_min, lon_max, lat_min, lat_max]"""
+        lats = [lat for _, lat, _, _ in city_coords]
+        lons = [lon for _, _, lon, _ in city_coords]
+        if len(city_coords) == 1:
+            # Для одного города - фиксированный масштаб
+            margin = 8
+        else:
+            # Для нескольких городов - адаптивный масштаб
+            margin = 15
+        return [max(min(lons) - margin, -180), min(max(lons) + margin, 180),
+                max(min(lats) - margin, -90), min(max(lats) + margin, 90)]
+
+    def build_figure(self, cities_data, map_style='detailed', scale=None):
+        """Строит фигуру карты с городами (общая часть для PNG и экспорта SVG/PDF)"""
+        # Создаем карту; фигура без pyplot - у нее нет общего глобального состояния,
+        # поэтому фоновый рендер не пересекается с интерактивным в другом потоке
+        fig = Figure(figsize=(14, 10))
+        ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+
+        # Собираем координаты и цвета
+        city_coords = self.collect_coordinates(cities_data)
+
+        if not city_coords:
+            print("Нет координат для отображения")
+            return None
+
+        # Для векторного экспорта (задан scale) геометрию подложки обрезаем сами
+        extent = self.map_extent(city_coords)
+        self.draw_basemap(ax, map_style, scale, extent if scale else None)
+        ax.set_extent(extent, crs=ccrs.PlateCarree())
+
+        # Отмечаем города
+        for city_name, lat, lon, color in city_coords:
+            ax.plot(lon, lat, 'o', markersize=14, color=color, 
+                   transform=ccrs.PlateCarree(), markeredgecolor='black', 
+                   markeredgewidth=2, alpha=0.8)
+            ax.text(lon + 0.8, lat + 0.5, city_name, transform=ccrs.PlateCarree(),
+                   fontsize=10, fontweight='bold', 
+                   bbox=dict(boxstyle="round,pad=0.4", facecolor='white', 
+                           alpha=0.9, edgecolor='gray'))
+
+        # Сетка
+        gl = ax.gridlines(draw_labels=True, alpha=0.3, linestyle='--')
+        gl.top_labels = False
+        gl.right_labels = False
+
+        ax.set_title('🗺️ Карта городов', fontsize=18, fontweight='bold', pad=20)
+        fig.tight_layout()
+        return fig
+
+    def create_graph(self, path, cities_data, map_style='detailed', base_style='simple'):
+        """Создает карту с городами (base_style - подложка тепловой карты)"""
+        if map_style == 'heatmap':
+            return self.create_heatmap(path, cities_data, base_style)
+
         try:
-            # Создаем карту
-            fig = plt.figure(figsize=(14, 10))
-            ax = plt.axes(projection=ccrs.PlateCarree())
+            fig = self.build_figure(cities_data, map_style)
+            if fig is None:
+                return None
+
+            fig.savefig(path, dpi=300, bbox_inches='tight', facecolor='white')
             
-            # Разные стили карты
-            if map_style == 'detailed':
-                # Детальная карта с заливкой
-                ax.add_feature(cfeature.LAND, color='#f5f5f5', alpha=0.9)
-                ax.add_feature(cfeature.OCEAN, color='#e0f0ff', alpha=0.9)
-                ax.add_feature(cfeature.COASTLINE, linewidth=0.8, color='#333333')
-                ax.add_feature(cfeature.BORDERS, linestyle='--', linewidth=0.5, color='#666666')
-                ax.add_feature(cfeature.LAKES, color='#e0f0ff', alpha=0.7)
-                ax.add_feature(cfeature.RIVERS, color='#e0f0ff', linewidth=0.5)
-                
-            elif map_style == 'physical':
-                # Физическая карта
-                ax.stock_img()
-                ax.add_feature(cfeature.COASTLINE, linewidth=1.2, color='#333333')
-                ax.add_feature(cfeature.BORDERS, linestyle='-', linewidth=0.7, color='#555555')
-                
-            else:  # simple
-                # Простая карта
-                ax.add_feature(cfeature.COASTLINE, linewidth=1, color='#000000')
-                ax.add_feature(cfeature.BORDERS, linestyle=':', linewidth=0.7, color='#444444')
-
-            # Собираем координаты и цвета
-            lats, lons = [], []
-            city_coords = []
+            print(f"Карта успешно создана: {path}")
+            return path
             
-            for city_item in cities_data:
-                if isinstance(city_item, tuple):
-                    city_name, color = city_item
-                else:
-                    city_name, color = city_item, 'red'
-                
-                coords = self.get_coordinates(city_name)
-                if coords:
-                    lat, lon = coords
-                    lats.append(lat)
-                    lons.append(lon)
-                    city_coords.append((city_name, lat, lon, color))
+        except Exception as e:
+            print(f"Ошибка в create_graph: {e}")
+            return None
 
+    def export_map(self, path, cities_data, fmt, map_style='detailed'):
+        """Экспортирует карту в SVG, PDF или интерактивный HTML"""
+        if fmt == 'html':
+            return self.export_html(path, cities_data)
+
+        if map_style not in VECTOR_EXPORT_STYLES:
+            # В physical подложка - растровая stock_img, векторный файл вышел бы огромным
+            print(f"Стиль {map_style} недоступен для экспорта в {fmt}")
+            return None
+
+        try:
+            # Для векторных форматов берем грубую геометрию Natural Earth:
+            # файл остается маленьким, а при просмотре разница незаметна
+            fig = self.build_figure(cities_data, map_style, scale=VECTOR_EXPORT_SCALE)
+            if fig is None:
+                return None
+
+            # Текст в SVG оставляем текстом, а не кривыми
+            with matplotlib.rc_context({'svg.fonttype': 'none'}):
+                fig.savefig(path, format=fmt, bbox_inches='tight', facecolor='white')
+
+            print(f"Карта успешно экспортирована: {path}")
+            return path
+
+        except Exception as e:
+            print(f"Ошибка в export_map: {e}")
+            return None
+
+    def vector_geometries(self, feature, extent, scale=VECTOR_EXPORT_SCALE):
+        """Геометрия слоя Natural Earth, обрезанная по границам карты и упрощенная"""
+        lon_min, lon_max, lat_min, lat_max = extent
+        bbox = sgeom.box(lon_min, lat_min, lon_max, lat_max)
+        # Допуск упрощения - доля ширины карты, меньше пикселя при просмотре
+        tolerance = (lon_max - lon_min) / 2000
+        geometries = []
+        for geometry in feature.with_scale(scale).intersecting_geometries(extent):
+            geometry = geometry.intersection(bbox).simplify(tolerance)
+            if not geometry.is_empty:
+                geometries.append(geometry)
+        return geometries
+
+    def svg_path(self, geometries, extent, scale):
+        """Переводит геометрию в атрибут d для SVG (равнопромежуточная проекция)"""
+        lon_min, _, _, lat_max = extent
+        parts = []
+
+        def add_line(coords, closed):
+            points = [f'{(lon - lon_min) * scale:.1f},{(lat_max - lat) * scale:.1f}'
+                      for lon, lat in coords]
+            if len(points) > 1:
+                parts.append('M' + 'L'.join(points) + ('Z' if closed else ''))
+
+        def add_geometry(geometry):
+            if hasattr(geometry, 'geoms'):
+                for part in geometry.geoms:
+                    add_geometry(part)
+            elif geometry.geom_type == 'Polygon':
+                add_line(geometry.exterior.coords, True)
+                for ring in geometry.interiors:
+                    add_line(ring.coords, True)
+            elif geometry.geom_type in ('LineString', 'LinearRing'):
+                add_line(geometry.coords, False)
+
+        for geometry in geometries:
+            add_geometry(geometry)
+        return ''.join(parts)
+
+    def export_html(self, path, cities_data):
+        """Сохраняет автономную интерактивную карту: SVG-подложка и города в виде GeoJSON"""
+        try:
+            city_coords = self.collect_coordinates(cities_data)
             if not city_coords:
                 print("Нет координат для отображения")
                 return None
 
-            # Устанавливаем границы карты
-            if len(city_coords) == 1:
-                # Для одного города - фиксированный масштаб
-                lat, lon = city_coords[0][1], city_coords[0][2]
-                margin = 8
-                ax.set_extent([lon - margin, lon + margin, lat - margin, lat + margin], 
-                             crs=ccrs.PlateCarree())
-            else:
-                # Для нескольких городов - адаптивный масштаб
-                margin = 15
-                ax.set_extent([
-                    min(lons) - margin, max(lons) + margin,
-                    min(lats) - margin, max(lats) + margin
-                ], crs=ccrs.PlateCarree())
-
-            # Отмечаем города
-            for city_name, lat, lon, color in city_coords:
-                ax.plot(lon, lat, 'o', markersize=14, color=color, 
-                       transform=ccrs.PlateCarree(), markeredgecolor='black', 
-                       markeredgewidth=2, alpha=0.8)
-                ax.text(lon + 0.8, lat + 0.5, city_name, transform=ccrs.PlateCarree(),
-                       fontsize=10, fontweight='bold', 
-                       bbox=dict(boxstyle="round,pad=0.4", facecolor='white', 
-                               alpha=0.9, edgecolor='gray'))
-
-            # Сетка
+            geojson = {
+                'type': 'FeatureCollection',
+                'features': [{
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                    'properties': {'name': city_name, 'color': color},
+                } for city_name, lat, lon, color in city_coords],
+            }
+            extent = self.map_extent(city_coords)
+            lon_min, lon_max, lat_min, lat_max = extent
+            scale = HTML_MAP_SCALE
+
+            land = self.svg_path(self.vector_geometries(cfeature.LAND, extent), extent, scale)
+            borders = self.svg_path(self.vector_geometries(cfeature.BORDERS, extent), extent, scale)
+
+            # "</" внутри <script> закрыл бы тег раньше времени
+            data = json.dumps(geojson, ensure_ascii=False).replace('</', '<\\/')
+            page = HTML_MAP_TEMPLATE.format(
+                data=data, extent=json.dumps(extent), scale=scale,
+                width=round((lon_max - lon_min) * scale), height=round((lat_max - lat_min) * scale),
+                land=land, borders=borders, count=len(city_coords))
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(page)
+
+            print(f"HTML-карта успешно создана: {path}")
+            return path
+
+        except Exception as e:
+            print(f"Ошибка в export_html: {e}")
+            return None
+
+    def create_heatmap(self, path, cities_data, base_style='simple', cell=HEATMAP_CELL_DEGREES):
+        """Создает карту плотности городов (для пользователей с большим числом городов)"""
+        try:
+            city_coords = self.collect_coordinates(cities_data)
+            if not city_coords:
+                print("Нет координат для отображения")
+                return None
+
+            lats = np.array([lat for _, lat, _, _ in city_coords])
+            lons = np.array([lon for _, _, lon, _ in city_coords])
+            extent = self.map_extent(city_coords)
+
+            # Бинируем координаты в сетку - время отрисовки не зависит от числа городов.
+            # Ячейки квадратные и одного размера в градусах при любом охвате карты
+            bins = (max(1, math.ceil((extent[1] - extent[0]) / cell)),
+                    max(1, math.ceil((extent[3] - extent[2]) / cell)))
+            density, lon_edges, lat_edges = np.histogram2d(
+                lons, lats, bins=bins,
+                range=[[extent[0], extent[1]], [extent[2], extent[3]]])
+
+            # Сглаживаем ядром 3x3 с пиком 1, чтобы одиночные города не терялись:
+            # в ячейке с одним городом остается 1, соседние получают долю
+            kernel = np.array([0.5, 1.0, 0.5])
+            density = np.apply_along_axis(np.convolve, 0, density, kernel, mode='same')
+            density = np.apply_along_axis(np.convolve, 1, density, kernel, mode='same')
+            density = np.ma.masked_less_equal(density.T, 0)
+
+            fig = Figure(figsize=(14, 10))
+            ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+            self.draw_basemap(ax, base_style)
+            ax.set_extent(extent, crs=ccrs.PlateCarree())
+
+            # Один слой вместо отдельного маркера на каждый город
+            mesh = ax.pcolormesh(lon_edges, lat_edges, density, cmap='YlOrRd',
+                                 transform=ccrs.PlateCarree(), alpha=0.75, zorder=3)
+            fig.colorbar(mesh, ax=ax, shrink=0.6, label='Городов в ячейке (сглажено)')
+
             gl = ax.gridlines(draw_labels=True, alpha=0.3, linestyle='--')
             gl.top_labels = False
             gl.right_labels = False
 
-            plt.title('🗺️ Карта городов', fontsize=18, fontweight='bold', pad=20)
-            plt.tight_layout()
-            plt.savefig(path, dpi=300, bbox_inches='tight', facecolor='white')
-            plt.close()
-            
-            print(f"Карта успешно создана: {path}")
+            ax.set_title(f'🔥 Тепловая карта городов ({len(city_coords)})',
+                         fontsize=18, fontweight='bold', pad=20)
+            fig.tight_layout()
+            fig.savefig(path, dpi=300, bbox_inches='tight', facecolor='white')
+
+            print(f"Тепловая карта успешно создана: {path}")
             return path
-            
+
         except Exception as e:
-            print(f"Ошибка в create_graph: {e}")
+            print(f"Ошибка в create_heatmap: {e}")
+            return None
+
+    def create_timeline(self, path, timeline_data, fmt='gif'):
+        """Создает анимированную карту появления городов в порядке добавления"""
+        try:
+            if not self.find_ffmpeg():
+                print("ffmpeg не найден, анимированные карты недоступны")
+                return None
+
+            city_coords = self.collect_coordinates(timeline_data)
+            if not city_coords:
+                print("Нет координат для отображения")
+                return None
+
+            dates = {city: created_at for city, _, created_at in timeline_data}
+
+            # Если городов больше, чем кадров, показываем их группами
+            max_frames = min(TIMELINE_MAX_FRAMES,
+                             TIMELINE_MAX_SECONDS * TIMELINE_FPS - TIMELINE_HOLD_FRAMES)
+            groups = [list(chunk) for chunk in
+                      np.array_split(np.arange(len(city_coords)),
+                                     min(len(city_coords), max_frames))]
+
+            fig = Figure(figsize=(10, 7), dpi=100)
+            ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
+            self.draw_basemap(ax, 'simple')
+            ax.set_extent(self.map_extent(city_coords), crs=ccrs.PlateCarree())
+            ax.set_title('🕓 История путешествий', fontsize=16, fontweight='bold')
+
+            caption = ax.text(0.02, 0.03, '', transform=ax.transAxes, fontsize=11,
+                              fontweight='bold', animated=True, zorder=5,
+                              bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.9))
+
+            # Подложка рендерится один раз, дальше только дорисовываем маркеры;
+            # для blit нужен Agg-холст, без pyplot его подключаем явно
+            canvas = FigureCanvasAgg(fig)
+            canvas.draw()
+            background = canvas.copy_from_bbox(fig.bbox)
+            width, height = canvas.get_width_height()
+
+            encoder = self.open_frame_encoder(path, fmt, width, height)
+            if encoder is None:
+                return None
+
+            shown = 0
+            frame = None
+            with encoder:
+                for group in groups:
+                    canvas.restore_region(background)
+                    for index in group:
+                        city_name, lat, lon, color = city_coords[index]
+                        marker, = ax.plot(lon, lat, 'o', markersize=9, color=color,
+                                          transform=ccrs.PlateCarree(), markeredgecolor='black',
+                                          markeredgewidth=1.5, alpha=0.85, animated=True)
+                        ax.draw_artist(marker)
+                        marker.remove()
+                    shown += len(group)
+                    # Запоминаем подложку уже с новыми маркерами, но без подписи
+                    background = canvas.copy_from_bbox(fig.bbox)
+
+                    city_name = city_coords[group[-1]][0]
+                    date = dates.get(city_name) or ''
+                    caption.set_text(f"{shown}/{len(city_coords)}  {city_name}  {str(date)[:10]}")
+                    ax.draw_artist(caption)
+                    canvas.blit(fig.bbox)
+
+                    frame = bytes(canvas.buffer_rgba())
+                    encoder.write(frame)
+
+                # Задерживаем последний кадр
+                for _ in range(TIMELINE_HOLD_FRAMES):
+                    encoder.write(frame)
+
+            if not encoder.ok:
+                print("Ошибка кодирования анимации")
+                return None
+
+            print(f"Анимированная карта успешно создана: {path}")
+            return path
+
+        except Exception as e:
+            print(f"Ошибка в create_timeline: {e}")
             return None
 
+    def find_ffmpeg(self):
+        """Путь к ffmpeg или None - без него анимированные карты недоступны"""
+        return shutil.which(matplotlib.rcParams['animation.ffmpeg_path']) or shutil.which('ffmpeg')
+
+    def open_frame_encoder(self, path, fmt, width, height):
+        """Открывает потоковый кодировщик кадров"""
+        # Только ffmpeg: кадры уходят в него сразу, и память не растет с их числом
+        ffmpeg = self.find_ffmpeg()
+        if not ffmpeg:
+            print("ffmpeg не найден, анимированные карты недоступны")
+            return None
+        return FFmpegFrameEncoder(ffmpeg, path, fmt, width, height, TIMELINE_FPS)
+
     def draw_distance(self, city1, city2, path):
         """Рисует линию между двумя городами"""
         try:
@@ -307,8 +868,8 @@ class DB_Map():
             if not coords1 or not coords2:
                 return None
 
-            fig = plt.figure(figsize=(12, 8))
-            ax = plt.axes(projection=ccrs.PlateCarree())
+            fig = Figure(figsize=(12, 8))
+            ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
             ax.stock_img()
             
             lat1, lon1 = coords1
@@ -330,10 +891,9 @@ class DB_Map():
                    fontweight='bold', ha='center', fontsize=11,
                    bbox=dict(boxstyle="round,pad=0.3", facecolor='white', alpha=0.8))
             
-            plt.title(f'📏 Расстояние: {city1} - {city2}', fontsize=16, fontweight='bold')
-            plt.tight_layout()
-            plt.savefig(path, dpi=300, bbox_inches='tight')
-            plt.close()
+            ax.set_title(f'📏 Расстояние: {city1} - {city2}', fontsize=16, fontweight='bold')
+            fig.tight_layout()
+            fig.savefig(path, dpi=300, bbox_inches='tight')
             
             return path
             
@@ -342,6 +902,44 @@ class DB_Map():
             return None
 
 
+class FFmpegFrameEncoder():
+    """Передает кадры RGBA в ffmpeg через stdin, не накапливая их в памяти"""
+    def __init__(self, ffmpeg, path, fmt, width, height, fps):
+        if fmt == 'mp4':
+            # libx264 требует четные размеры кадра
+            output_args = ['-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+                           '-vcodec', 'libx264', '-pix_fmt', 'yuv420p',
+                           '-movflags', '+faststart', '-f', 'mp4']
+        else:
+            output_args = ['-f', 'gif']
+        self.process = subprocess.Popen(
+            [ffmpeg, '-y', '-loglevel', 'error',
+             '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}',
+             '-r', str(fps), '-i', '-'] + output_args + [path],
+            stdin=subprocess.PIPE)
+        self.ok = False
+
+    def write(self, frame):
+        self.process.stdin.write(frame)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # При ошибке ffmpeg больше не нужен: не ждем, пока он доработает
+        if exc_type is not None:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            # ffmpeg уже завершился (например, нет libx264) - close сбрасывает буфер в закрытый канал
+            pass
+        finally:
+            # Всегда забираем код возврата, чтобы не оставлять зомби-процесс
+            self.ok = self.process.wait() == 0 and exc_type is None
+        return False
+
+
 if __name__=="__main__":
     # Тестирование класса
     m = DB_Map(DATABASE)
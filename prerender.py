@@ -0,0 +1,144 @@
+import fcntl
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Prerenderer():
+    """Фоновая подготовка карт пользователей после изменения их списка городов.
+
+    После правки ждем debounce секунд (новая правка перезапускает ожидание),
+    затем ставим рендер в очередь. Рендер запускается только когда нет
+    интерактивных запросов и бот простаивает хотя бы idle секунд.
+
+    Рендер идет в отдельном процессе с пониженным приоритетом, чтобы не
+    отнимать GIL у интерактивных запросов. Процесс прерывается, если пришел
+    интерактивный запрос (рендер повторится позже) или пользователь снова
+    изменил города (рендер устарел).
+
+    Состояние хранится в файлах блокировок в lock_dir, поэтому при общем
+    каталоге (кэш карт в режиме --workers) интерактивные запросы видны
+    всем процессам бота, а max_concurrent ограничивает фоновые рендеры
+    суммарно по всем процессам.
+    """
+    def __init__(self, render, debounce=5.0, idle=2.0, max_concurrent=1, lock_dir=None):
+        self.render = render
+        self.debounce = debounce
+        self.idle = idle
+        self.max_concurrent = max_concurrent
+        self.lock_dir = lock_dir or os.path.join(tempfile.gettempdir(), 'maps_prerender')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self.activity_path = os.path.join(self.lock_dir, 'interactive.lock')
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.generations = {}
+        self.jobs = queue.Queue()
+        threading.Thread(target=self.work, daemon=True).start()
+
+    def schedule(self, user_id):
+        """Отмечает, что города пользователя изменились"""
+        with self.lock:
+            generation = self.generations.get(user_id, 0) + 1
+            self.generations[user_id] = generation
+            timer = self.timers.pop(user_id, None)
+            if timer:
+                timer.cancel()
+            timer = threading.Timer(self.debounce, self.jobs.put, args=((user_id, generation),))
+            timer.daemon = True
+            self.timers[user_id] = timer
+            timer.start()
+
+    @contextmanager
+    def interactive(self):
+        """Оборачивает интерактивный запрос, чтобы фоновые рендеры ему не мешали"""
+        # Разделяемая блокировка на время запроса видна всем процессам бота
+        with open(self.activity_path, 'a') as activity:
+            fcntl.flock(activity, fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                # Время изменения файла - момент последней интерактивной активности
+                os.utime(self.activity_path)
+                fcntl.flock(activity, fcntl.LOCK_UN)
+
+    def is_idle(self):
+        with open(self.activity_path, 'a') as activity:
+            try:
+                fcntl.flock(activity, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Какой-то процесс сейчас обрабатывает интерактивный запрос
+                return False
+            fcntl.flock(activity, fcntl.LOCK_UN)
+        return time.time() - os.path.getmtime(self.activity_path) >= self.idle
+
+    def is_current(self, user_id, generation):
+        with self.lock:
+            return self.generations.get(user_id) == generation
+
+    def acquire_slot(self):
+        """Занимает один из max_concurrent слотов фонового рендера (на все процессы)"""
+        for index in range(self.max_concurrent):
+            slot = open(os.path.join(self.lock_dir, f'slot_{index}.lock'), 'a')
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        return None
+
+    def run_render(self, user_id):
+        """Точка входа процесса фонового рендера"""
+        # Фоновые рендеры не должны отнимать процессор у интерактивных
+        os.nice(10)
+        # terminate() присылает SIGTERM: выходим через SystemExit, чтобы отработали
+        # finally (удаление временных файлов кэша)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+        self.render(user_id)
+
+    def work(self):
+        while True:
+            user_id, generation = self.jobs.get()
+            with self.lock:
+                if self.timers.get(user_id) and self.generations.get(user_id) == generation:
+                    del self.timers[user_id]
+
+            try:
+                self.render_job(user_id, generation)
+            except Exception as e:
+                print(f"Ошибка фонового рендера для {user_id}: {e}")
+
+    def render_job(self, user_id, generation):
+        while self.is_current(user_id, generation):
+            slot = None
+            while self.is_current(user_id, generation):
+                if self.is_idle():
+                    slot = self.acquire_slot()
+                    if slot:
+                        break
+                time.sleep(0.5)
+
+            # Пока ждали, пользователь снова изменил города - рендер уже устарел
+            if slot is None:
+                return
+
+            with slot:
+                process = multiprocessing.Process(target=self.run_render, args=(user_id,),
+                                                  daemon=True)
+                process.start()
+                while process.is_alive():
+                    process.join(0.2)
+                    if not self.is_current(user_id, generation) or not self.is_idle():
+                        process.terminate()
+                        process.join()
+                        break
+                else:
+                    if process.exitcode != 0:
+                        print(f"Фоновый рендер для {user_id} завершился с кодом {process.exitcode}")
+                    return
+            # Прервали из-за интерактивного запроса - повторим, когда бот освободится
@@ -0,0 +1,90 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+
+
+class RenderCache():
+    """Общий дисковый кэш готовых карт для всех процессов бота"""
+    def __init__(self, directory=None, max_entries=500):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'maps_render_cache')
+        self.max_entries = max_entries
+        self.locks_dir = os.path.join(self.directory, 'locks')
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+    def key(self, *parts):
+        """Ключ кэша по содержимому карты (стиль, города, цвета)"""
+        data = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def path_for(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def cached_path(self, key, suffix):
+        """Возвращает путь к готовой карте или None, если ее еще нет"""
+        path = self.path_for(key, suffix)
+        if os.path.exists(path):
+            # Обновляем время доступа для вытеснения старых карт
+            os.utime(path)
+            return path
+        return None
+
+    def get_or_render(self, key, suffix, render):
+        """Возвращает карту из кэша, при промахе рендерит ее ровно один раз на все процессы"""
+        path = self.cached_path(key, suffix)
+        if path:
+            return path
+
+        lock_path = os.path.join(self.locks_dir, key + '.lock')
+        with open(lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Пока мы ждали блокировку, карту мог нарисовать другой процесс
+            path = self.cached_path(key, suffix)
+            if path:
+                return path
+
+            # Расширение оставляем в конце - по нему matplotlib выбирает формат
+            tmp_path = os.path.join(self.directory, f'{key}.{os.getpid()}.tmp{suffix}')
+            try:
+                if not render(tmp_path):
+                    return None
+                os.replace(tmp_path, self.path_for(key, suffix))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+        self.prune()
+        return self.path_for(key, suffix)
+
+    def prune(self):
+        """Удаляет самые старые карты сверх max_entries"""
+        with open(os.path.join(self.directory, '.prune.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Очисткой уже занимается другой процесс
+                return
+
+            entries = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.startswith('.') or '.tmp' in name or not os.path.isfile(path):
+                    continue
+                try:
+                    entries.append((os.path.getmtime(path), name))
+                except FileNotFoundError:
+                    continue
+
+            if len(entries) <= self.max_entries:
+                return
+
+            entries.sort()
+            for _, name in entries[:len(entries) - self.max_entries]:
+                key = name.split('.', 1)[0]
+                for path in (os.path.join(self.directory, name),
+                             os.path.join(self.locks_dir, key + '.lock')):
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
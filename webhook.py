@@ -0,0 +1,138 @@
+import hmac
+import json
+import queue
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def extract_chat_id(update):
+    """Достает chat.id из обновления Telegram (None, если чата нет)"""
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in update:
+            return update[key]['chat']['id']
+    if 'callback_query' in update:
+        callback = update['callback_query']
+        if 'message' in callback:
+            return callback['message']['chat']['id']
+        return callback['from']['id']
+    return None
+
+
+def shard_for(chat_id, workers):
+    """Номер воркера для чата - все обновления одного пользователя идут в один воркер"""
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+
+class UpdateQueue():
+    """Ограниченная очередь обновлений с пулом потоков-обработчиков.
+
+    У каждого потока своя очередь, чат закреплен за потоком по chat.id,
+    поэтому обновления одного пользователя обрабатываются по порядку.
+    """
+    def __init__(self, handler, threads=4, maxsize=100):
+        self.handler = handler
+        self.queues = [queue.Queue(maxsize) for _ in range(threads)]
+        self.threads = [threading.Thread(target=self.work, args=(q,), daemon=True)
+                        for q in self.queues]
+        for thread in self.threads:
+            thread.start()
+
+    def dispatch(self, update):
+        """Ставит обновление в очередь; False, если очередь переполнена"""
+        chat_id = extract_chat_id(update)
+        index = shard_for(chat_id, len(self.queues)) if chat_id is not None else 0
+        try:
+            self.queues[index].put_nowait(update)
+            return True
+        except queue.Full:
+            return False
+
+    def work(self, updates):
+        while True:
+            update = updates.get()
+            if update is None:
+                return
+            try:
+                self.handler(update)
+            except Exception as e:
+                print(f"Ошибка обработки обновления: {e}")
+            finally:
+                updates.task_done()
+
+    def join(self):
+        """Ждет обработки всего, что уже стоит в очереди"""
+        for updates in self.queues:
+            updates.join()
+
+    def close(self):
+        for updates in self.queues:
+            updates.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Принимает обновления Telegram, передает их в dispatch и сразу отвечает"""
+    def do_POST(self):
+        server = self.server
+        if self.path != server.path:
+            self.send_error(404)
+            return
+
+        # Telegram присылает секрет в заголовке, сравниваем за постоянное время
+        # в байтах: compare_digest не принимает строки с не-ASCII символами,
+        # а http.server декодирует заголовки как latin-1
+        token = self.headers.get(SECRET_HEADER, '').encode('latin-1', 'replace')
+        if server.secret_token and not hmac.compare_digest(
+                token, server.secret_token.encode('utf-8')):
+            self.send_error(403)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_error(400)
+            return
+
+        # Переполненная очередь - отвечаем 503, Telegram пришлет обновление повторно
+        if server.dispatch(update) is False:
+            self.send_error(503)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_request(self, code='-', size='-'):
+        # Не засоряем вывод строкой на каждое обновление; ошибки (404, 403, 503)
+        # по-прежнему пишутся через log_error
+        pass
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """Локальный HTTP-сервер для webhook-режима бота"""
+    daemon_threads = True
+
+    def __init__(self, address, dispatch, secret_token='', path='/'):
+        super().__init__(address, WebhookHandler)
+        self.dispatch = dispatch
+        self.secret_token = secret_token
+        self.path = path
+
+
+def run_webhook(host, port, handler, secret_token='', path='/', threads=4, maxsize=100):
+    """Webhook-режим в одном процессе: HTTP-сервер и очередь с потоками-обработчиками"""
+    updates = UpdateQueue(handler, threads, maxsize)
+    server = WebhookServer((host, port), updates.dispatch, secret_token, path)
+    print(f"🌐 Webhook слушает {host}:{port}{path}, потоков: {threads}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        updates.close()